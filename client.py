@@ -7,6 +7,7 @@ from six.moves import queue
 import os
 import sys
 import uuid
+from collections import Counter
 
 from package.game import Game
 
@@ -124,6 +125,15 @@ def handle_message(msg):
             os.remove(ID_FILE)
         return str("exit")
 
+    elif cmd == "DUPLICATE_ID":
+        print("另一個用戶端正使用相同的玩家 id 連線，本連線已被取代。\n"
+              "已移除 %s，重新啟動即可取得新的 id。\n" % ID_FILE)
+        if os.path.exists(ID_FILE):
+            os.remove(ID_FILE)
+        # 讓 prompt_loop 結束，避免卡在等待提示
+        prompt_queue.put({"type": "exit"})
+        return str("exit")
+
     elif cmd == "DISCONNECTED":
         print("%s 失去連線...\n" % parts[1])
         return None
@@ -148,10 +158,10 @@ def handle_message(msg):
 
 
 def recv_and_handle(client_socket):
-    _buffer = ""
+    _buffer = bytearray()
     while True:
         try:
-            data = client_socket.recv(1024).decode("utf-8")
+            data = client_socket.recv(4096)
         except Exception as e:
             err_no, raw_msg = e.args
             readable = raw_msg.decode('cp950', errors='replace')
@@ -164,10 +174,14 @@ def recv_and_handle(client_socket):
             print("伺服器已關閉連線")
             break
 
-        _buffer += data
-        while "\n" in _buffer:
-            line, _buffer = _buffer.split("\n", 1)
-            text = line
+        # 以 bytes 切行後再解碼，避免多位元組字元被 recv 切斷
+        _buffer.extend(data)
+        while True:
+            i = _buffer.find(b"\n")
+            if i < 0:
+                break
+            text = bytes(_buffer[:i]).decode("utf-8")
+            del _buffer[:i + 1]
             if not text:
                 continue
             reply = handle_message(text)
@@ -218,13 +232,14 @@ def prompt_loop(client_socket):
                 return
 
         elif ptype == "GUESS":
-            number_hand = item["number_hand"]
+            hand_count = Counter(item["number_hand"].split(","))
             while True:
                 guess = list(input(prompt_text).strip())
                 if len(guess) != Game.NUM_GUESS_DIGITS:
                     print("長度錯誤，請重新輸入。")
                     continue
-                if any(d not in number_hand for d in guess):
+                # 與伺服器相同的檢查：每個數字使用次數不能超過手牌張數
+                if Counter(guess) - hand_count:
                     print("有數字不在手牌中，請重新輸入。")
                     continue
                 break
@@ -10,11 +10,13 @@ class Player(object):
         self.best_B = 0
         self.guess_histories = []
 
-        self.cmd_queue = None
-        self.heartbeat_queue = None
+        self.cmd_deque = None
+        self.cmd_ready = None
+        self.heartbeat_ack = None
 
         self.socket = None
         self.is_alive = False
+        self.last_hand = None   # 上次送給玩家的 HAND 訊息
 
     def to_dict(self):
         return {
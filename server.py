@@ -1,11 +1,12 @@
 # server.py
 # -*- coding: utf-8 -*-
 
-from __future__ import print_function, unicode_literals
+from __future__ import unicode_literals
+import sys
 import threading
 import socket
 import time
-import six
+from collections import Counter, deque
 from datetime import datetime
 from uuid import uuid4
 
@@ -19,16 +20,87 @@ try:
 except ImportError:
     import Queue as queue
 
-try:
-    import SocketServer  # Python 2
-except ImportError:
-    import socketserver as SocketServer  # Python 3
+# 固定的協定訊息，預先編碼好
+_TOOL = b"TOOL\n"
+_POS = b"POS\n"
+_DOUBLE_ACTIVE = b"DOUBLE_ACTIVE\n"
+_RESHUFFLE_DONE = b"RESHUFFLE_DONE\n"
+_HEARTBEAT = b"HEARTBEAT\n"
+_WINNER = b"WINNER\n"
+_DRAW = b"DRAW\n"
+_DUPLICATE_ID = b"DUPLICATE_ID\n"
+
+# 帶參數的協定訊息模板
+_HAND_FMT = "HAND %s;%s\n"
+_STATUS_FMT = "STATUS %s\n"
+_USED_TOOL_FMT = "USED_TOOL %s\n"
+_OPP_TOOL_FMT = "OPP_TOOL %s %s\n"
+_POS_RESULT_FMT = "POS_RESULT %d %s\n"
+_SHUFFLE_RESULT_FMT = "SHUFFLE_RESULT %s\n"
+_EXCLUDE_RESULT_FMT = "EXCLUDE_RESULT %s\n"
+_GUESS_FMT = "GUESS %s\n"
+_RESULT_FMT = "RESULT %d %d\n"
+_OPP_GUESS_FMT = "OPP_GUESS %s %s %d %d\n"
+_WINNER_FMT = "WINNER %s\n"
+_DISCONNECTED_FMT = "DISCONNECTED %s\n"
+
+
+# (秒數, 格式化後的時間字串)；時間戳只精確到秒，同一秒內重複使用
+_ts_cache = (0, u"")
 
 
 def format_log(msg):
     """回傳帶時間戳的 log 字串。"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return u"[{}] {}".format(timestamp, msg)
+    global _ts_cache
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache = (t, datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S'))
+    return u"[%s] %s" % (_ts_cache[1], msg)
+
+
+_log_queue = queue.Queue()
+_log_thread = None
+_log_thread_lock = threading.Lock()
+
+
+def log(msg):
+    """把 log 丟給 _log_worker 輸出，不在遊戲流程中直接寫 stdout。"""
+    global _log_thread
+    if _log_thread is None:
+        # 第一次寫 log 時才啟動輸出 thread，不論 server 是怎麼被載入的
+        with _log_thread_lock:
+            if _log_thread is None:
+                t = threading.Thread(target=_log_worker)
+                t.daemon = True
+                t.start()
+                _log_thread = t
+    _log_queue.put(format_log(msg) + u"\n")
+
+
+def _log_worker():
+    """把累積的 log 合併成一次 write 輸出。"""
+    while True:
+        lines = [_log_queue.get()]
+        while True:
+            try:
+                lines.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        text = u"".join(lines)
+        try:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        except UnicodeError:
+            # 終端機編碼不支援的字元以替代字元輸出
+            encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+            try:
+                sys.stdout.write(text.encode(encoding, "replace").decode(encoding))
+                sys.stdout.flush()
+            except Exception:
+                pass
+        except Exception:
+            # stdout 無法寫入（例如 pipe 已關閉）時丟棄這批，worker 繼續運作
+            pass
 
 
 class ConnectionManager(object):
@@ -49,132 +121,236 @@ class ConnectionManager(object):
 
         # 等待配對的玩家佇列
         self._waiting_queue = queue.Queue()
-        self._reconnect_queue = queue.Queue()
 
         # Active game sessions
         self.active_sessions = {}
         self._lock = threading.Lock()
 
+    def register_session(self, session):
+        """登記新的遊戲房間，讓斷線重連的玩家可以接回。"""
+        with self._lock:
+            self.active_sessions[str(session._id)] = session
+
+    def unregister_session(self, session):
+        """遊戲結束後移除房間，釋放其中的玩家與 socket。"""
+        with self._lock:
+            self.active_sessions.pop(str(session._id), None)
+
+    @staticmethod
+    def _tune_socket(sock):
+        """
+        一問一答的小封包協定：關閉 Nagle 避免每次回覆卡在 ACK 等待，
+        並開啟 keepalive 讓核心也能偵測半開連線。
+        """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (socket.error, AttributeError):
+            pass
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except (socket.error, AttributeError):
+            pass
+
     def serve_forever(self):
         """
-        不斷 accept 新連線，為每位玩家建立 Player，
-        並啟動兩條執行緒：_cmd_reader、_heartbeat。
+        不斷 accept 新連線，每條連線交給 _on_new_client 執行緒處理，
+        避免單一玩家的 CHECK_ID 交握卡住後續連線。
         """
-        print(format_log("伺服器已啟動，開始接受連線…"))
+        log("伺服器已啟動，開始接受連線…")
         while True:
             client_sock, client_addr = self.listener.accept()
+            t = threading.Thread(target=self._on_new_client, args=(client_sock, client_addr))
+            t.daemon = True
+            t.start()
+
+    def _on_new_client(self, client_sock, client_addr):
+        """
+        為新連線建立 Player，並啟動兩條執行緒：_cmd_reader、_heartbeat；
+        之後放入等待佇列或接回原本的遊戲。
+        """
+        self._tune_socket(client_sock)
+        try:
             client_sock.sendall(b"CHECK_ID\n")
             player_id = client_sock.recv(1024).strip()
-
-            # 建立 Player
-            # TODO: 讓玩家的連線帶有 id 的參數 (如果有的話)
-            player = Player(player_id)
-            player.socket = client_sock
-            player.address = client_addr
-            player.cmd_queue = queue.Queue()
-            player.heartbeat_queue = queue.Queue()
-            player.is_alive = True
-
-            # 啟動讀命令執行緒
-            t1 = threading.Thread(target=self._cmd_reader, args=(player,))
-            t1.daemon = True
-            t1.start()
-            # 啟動心跳檢測執行緒
-            t2 = threading.Thread(target=self._heartbeat, args=(player,))
-            t2.daemon = True
-            t2.start()
-
-            game_session_id = self._redis_handler.read_player_game(player_id)
-            if game_session_id is None:
-                # 推入等待佇列，交給配對器
-                self._waiting_queue.put(player)
-                print(format_log("%s 已連線，放入等待佇列" % player.name))
-            else:
-                if game_session_id in self.active_sessions:
-                    session = self.active_sessions[game_session_id]
-                    for i in range(len(session.players)):
-                        if session.players[i].name == player.name:
-                            session.players[i] = player
-                            break
-                else:
-                    self._redis_handler.delete_game_state(game_session_id)
-                    self._waiting_queue.put(player)
-                    print(format_log("%s 已連線，放入等待佇列" % player.name))
+        except socket.error:
+            client_sock.close()
+            return
+
+        # 建立 Player
+        # TODO: 讓玩家的連線帶有 id 的參數 (如果有的話)
+        player = Player(player_id)
+        player.socket = client_sock
+        player.address = client_addr
+        player.cmd_deque = deque()
+        player.cmd_ready = threading.Event()
+        player.heartbeat_ack = threading.Event()
+        player.is_alive = True
+
+        # 啟動讀命令執行緒
+        t1 = threading.Thread(target=self._cmd_reader, args=(player,))
+        t1.daemon = True
+        t1.start()
+        # 啟動心跳檢測執行緒
+        t2 = threading.Thread(target=self._heartbeat, args=(player,))
+        t2.daemon = True
+        t2.start()
+
+        game_session_id = self._redis_handler.read_player_game(player_id)
+        if game_session_id is None:
+            # 推入等待佇列，交給配對器
+            self._waiting_queue.put(player)
+            log("%s 已連線，放入等待佇列" % player.name)
+            return
+
+        with self._lock:
+            session = self.active_sessions.get(game_session_id)
+            if session is not None and session.rejoin(player):
+                return
+        if session is None:
+            self._redis_handler.delete_game_state(game_session_id)
+        else:
+            # 房間還在但沒有這位玩家的座位，只清掉他自己過期的紀錄
+            self._redis_handler.delete_player_game(player_id)
+        self._waiting_queue.put(player)
+        log("%s 已連線，放入等待佇列" % player.name)
 
     def _cmd_reader(self, player):
         """
         永遠從 socket.recv() 讀資料：
-          - 收到空 bytes → 推入 DISCONNECT
-          - 收到 HEARTBEAT_ACK → heartbeat_queue
-          - 否則推入 cmd_queue
+          - 收到空 bytes → 推入 DISCONNECTED
+          - 收到 HEARTBEAT_ACK → 設定 heartbeat_ack
+          - 否則推入 cmd_deque
         """
         sock = player.socket
-        buf = b""
+        buf = bytearray()
+        # 重複使用的接收緩衝區，避免每次 recv 都配置新的 bytes
+        rxbuf = bytearray(8192)
+        rxview = memoryview(rxbuf)
         while True:
             try:
-                data = sock.recv(1024)
+                n = sock.recv_into(rxview)
             except Exception:
-                player.cmd_queue.put({'type': 'DISCONNECT'})
+                player.is_alive = False
+                ConnectionManager.push_cmd(player, {'type': 'DISCONNECTED'})
                 return
-            if not data:
-                player.cmd_queue.put({'type': 'DISCONNECT'})
+            if not n:
+                player.is_alive = False
+                ConnectionManager.push_cmd(player, {'type': 'DISCONNECTED'})
                 return
-            buf += data
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
+            buf += rxview[:n]
+            while True:
+                i = buf.find(b"\n")
+                if i < 0:
+                    break
+                line = bytes(buf[:i])
+                del buf[:i + 1]
                 text = line.decode('utf-8').strip()
                 if text == "HEARTBEAT_ACK":
-                    player.heartbeat_queue.put(True)
+                    player.heartbeat_ack.set()
                 else:
-                    player.cmd_queue.put({'type': 'COMMAND', 'data': text})
+                    ConnectionManager.push_cmd(player, {'type': 'COMMAND', 'data': text})
+
+    @staticmethod
+    def push_cmd(player, item):
+        """推入一筆指令並喚醒等待中的遊戲執行緒。"""
+        player.cmd_deque.append(item)
+        player.cmd_ready.set()
+
+    @staticmethod
+    def pop_cmd(player):
+        """取出下一筆指令；沒有指令時阻塞等待（單一消費者）。"""
+        while True:
+            # 先 clear 再檢查，避免錯過 clear 之前剛推入的指令
+            player.cmd_ready.clear()
+            if player.cmd_deque:
+                return player.cmd_deque.popleft()
+            player.cmd_ready.wait()
 
     @staticmethod
     def send_to(player, msg):
-        if not isinstance(msg, six.text_type):
-            msg = msg.decode('utf-8')
+        data = msg if isinstance(msg, (bytes, bytearray)) else msg.encode('utf-8')
         try:
-            player.socket.sendall(msg.encode('utf-8'))
+            player.socket.sendall(data)
         except Exception:
-            try:
-                player.socket.close()
-            except Exception:
-                player.is_alive = False
+            ConnectionManager._send_failed(player)
+
+    @staticmethod
+    def send_many(player, msgs):
+        """
+        把同一位玩家的多則訊息一次送出：支援 sendmsg 的平台直接交給核心
+        聚合 (scatter-gather)，否則合併成一次 sendall。
+        """
+        if not msgs:
+            return
+        parts = [m if isinstance(m, bytes) else m.encode('utf-8') for m in msgs]
+        if len(parts) == 1 or not hasattr(player.socket, "sendmsg"):
+            ConnectionManager.send_to(player, b"".join(parts))
+            return
+        try:
+            sent = player.socket.sendmsg(parts)
+            if sent < sum(len(m) for m in parts):
+                # 只送出部分資料時，剩下的用 sendall 補完
+                player.socket.sendall(b"".join(parts)[sent:])
+        except Exception:
+            ConnectionManager._send_failed(player)
+
+    @staticmethod
+    def _send_failed(player):
+        """send_to / send_many 共用的送出失敗處理。"""
+        try:
+            player.socket.close()
+        except Exception:
+            player.is_alive = False
 
     def _heartbeat(self, player, interval=5, timeout=10):
         """
         每隔 interval 秒發 HEARTBEAT，並在 timeout 秒內等 ACK；
-        否則推入 DISCONNECT。
+        否則推入 DISCONNECTED。
         """
         while True:
+            player.heartbeat_ack.clear()
             try:
-                print(format_log("%s - HEARTBEAT" % player.name))
-                ConnectionManager.send_to(player, "HEARTBEAT\n")
+                log("%s - HEARTBEAT" % player.name)
+                ConnectionManager.send_to(player, _HEARTBEAT)
             except Exception:
-                player.cmd_queue.put({'type': 'DISCONNECTED'})
+                player.is_alive = False
+                ConnectionManager.push_cmd(player, {'type': 'DISCONNECTED'})
                 return
-            try:
-                # 等待 ACK
-                player.heartbeat_queue.get(timeout=timeout)
-            except Exception:
-                player.cmd_queue.put({'type': 'DISCONNECTED'})
+            # 等待 ACK
+            if not player.heartbeat_ack.wait(timeout):
+                player.is_alive = False
+                ConnectionManager.push_cmd(player, {'type': 'DISCONNECTED'})
                 return
             time.sleep(interval)
 
 
 class GameSession(object):
     """一對玩家的遊戲執行個體（Threaded）"""
-    def __init__(self, p1, p2):
+    def __init__(self, p1, p2, conn_mgr):
+        if p1.name == p2.name:
+            raise ValueError("duplicate player id: %s" % p1.name)
         self.players = [p1, p2]
+        # 玩家 id → self.players 中的座位，重連時直接定位
+        self._seats = {p1.name: 0, p2.name: 1}
+        self._conn_mgr = conn_mgr
         self._store_handler = RedisStore()
         self._id = uuid4()
 
+    def rejoin(self, player):
+        """以重新連線的 Player 取代原座位上的舊物件。"""
+        idx = self._seats.get(player.name)
+        if idx is None:
+            return False
+        self.players[idx] = player
+        return True
+
     def _handle_disconnect(self, player):
-        print(format_log("%s - DISCONNECTED" % player.name))
-        self.broadcast("DISCONNECTED %s\n" % player.name, skip=player)
+        log("%s - DISCONNECTED" % player.name)
+        self.broadcast(_DISCONNECTED_FMT % player.name, skip=player)
         player.is_alive = False
 
         if len(self.players) < 2:
-            ConnectionManager.send_to(player, "WINNER\n")
+            ConnectionManager.send_to(player, _WINNER)
 
     def broadcast(self, msg, skip=None):
         for p in self.players:
@@ -186,37 +362,126 @@ class GameSession(object):
         self._store_handler.save_game_state(self._id, game_state)
 
     def _close_game(self):
+        self._conn_mgr.unregister_session(self)
         self._store_handler.delete_game_state(self._id)
         for p in self.players:
             p.socket.close()
 
     def _get_cmd(self, player):
-        try:
-            msg = player.cmd_queue.get()
-        except Exception:
-            self._handle_disconnect(player)
-            return None
-
+        msg = ConnectionManager.pop_cmd(player)
         if msg["type"] == "DISCONNECTED":
             self._handle_disconnect(player)
             return None
 
         return msg
 
+    @staticmethod
+    def _hand_update(player, nums=None):
+        """
+        手牌跟上次送出的不同時才回傳 HAND 訊息，否則回傳空 list。
+        nums 可傳入已經 join 好的數字手牌，避免重複 join。
+        """
+        if nums is None:
+            nums = ",".join(player.number_hand)
+        msg = (_HAND_FMT % (nums, ",".join(player.tool_hand))).encode('utf-8')
+        if msg == player.last_hand:
+            return []
+        player.last_hand = msg
+        log("%s - HAND" % player.name)
+        return [msg]
+
+    def _read_pos(self, current, max_pos):
+        """讀取 1~max_pos 的位置，不合法就重新詢問；斷線回傳 None。"""
+        while True:
+            msg = self._get_cmd(current)
+            if msg is None:
+                return None
+            try:
+                pos = int(msg["data"])
+            except ValueError:
+                pos = 0
+            if 1 <= pos <= max_pos:
+                return pos
+            ConnectionManager.send_to(current, _POS)
+
+    def _read_guess(self, current, num_digits, prompt):
+        """讀取猜測，長度不對或用了手牌沒有的數字就重新詢問；斷線回傳 None。"""
+        while True:
+            msg = self._get_cmd(current)
+            if msg is None:
+                return None
+            guess = str(msg["data"])
+            if len(guess) == num_digits and not Counter(guess) - Counter(current.number_hand):
+                return guess
+            ConnectionManager.send_to(current, prompt)
+
+    # 道具處理：回傳是否多猜一次；回傳 None 代表玩家斷線，跳過本回合
+    def _tool_pos(self, game, current, idx, out_current):
+        log("%s - POS" % current.name)
+        out_current.append(_POS)
+        ConnectionManager.send_many(current, out_current)
+        del out_current[:]
+
+        pos = self._read_pos(current, game.NUM_GUESS_DIGITS)
+        if pos is None:
+            return None
+
+        # 等待輸入期間對手可能重新連線，重新取得座位上的玩家
+        opponent = self.players[(idx + 1) % 2]
+        digit = ToolCard.pos(opponent.answer, pos - 1)
+        log("%s - POS_RESULT" % current.name)
+        out_current.append(_POS_RESULT_FMT % (pos, digit))
+        return False
+
+    def _tool_shuffle(self, game, current, idx, out_current):
+        ToolCard.shuffle(current.answer)
+        log("%s - SHUFFLE_RESULT" % current.name)
+        out_current.append(_SHUFFLE_RESULT_FMT % "".join(current.answer))
+        return False
+
+    def _tool_exclude(self, game, current, idx, out_current):
+        opponent = self.players[(idx + 1) % 2]
+        exclude_result = ToolCard.exclude(opponent.answer)
+        log("%s - EXCLUDE_RESULT" % current.name)
+        out_current.append(_EXCLUDE_RESULT_FMT % exclude_result)
+        return False
+
+    def _tool_double(self, game, current, idx, out_current):
+        log("%s - DOUBLE_ACTIVE" % current.name)
+        out_current.append(_DOUBLE_ACTIVE)
+        return True
+
+    def _tool_reshuffle(self, game, current, idx, out_current):
+        ToolCard.reshuffle(current.number_hand, game.number_deck)
+        log("%s - RESHUFFLE_DONE" % current.name)
+        out_current.append(_RESHUFFLE_DONE)
+        return False
+
+    _TOOL_HANDLERS = {
+        "POS": _tool_pos,
+        "SHUFFLE": _tool_shuffle,
+        "EXCLUDE": _tool_exclude,
+        "DOUBLE": _tool_double,
+        "RESHUFFLE": _tool_reshuffle,
+    }
+
     def run(self):
         game = Game(self.players)
+        # 回合迴圈中常用的屬性先綁成區域變數
+        num_digits = game.NUM_GUESS_DIGITS
+        max_rounds = game.MAX_ROUNDS
+        send_to = ConnectionManager.send_to
+        send_many = ConnectionManager.send_many
         self._store_handler.save_game_state(self._id, game.to_dict())
         for player in self.players:
             self._store_handler.save_player_game(player.name, str(self._id))
 
         # 發初始手牌
         for p in self.players[1:]:
-            nums  = ",".join(p.number_hand)
-            tools = ",".join(p.tool_hand)
-            ConnectionManager.send_to(p, "HAND %s;%s\n" % (nums, tools))
+            send_many(p, self._hand_update(p))
 
         # 回合循環
-        while game.round < game.MAX_ROUNDS:
+        while game.round < max_rounds:
             if len(self.players) < 2:
                 break
 
@@ -224,135 +489,126 @@ class GameSession(object):
                 current  = self.players[idx]
                 opponent = self.players[(idx+1) % 2]
 
-                # 發送最新手牌
-                nums = ",".join(current.number_hand)
-                tools = ",".join(current.tool_hand)
-                print(format_log("%s - HAND" % current.name))
-                ConnectionManager.send_to(current, "HAND %s;%s\n" % (nums, tools))
-
                 # 廣播狀態給對手
                 for p in self.players:
                     if p is not current:
-                        print(format_log("%s - STATUS" % p.name))
-                        ConnectionManager.send_to(p, "STATUS %s\n" % current.name)
+                        log("%s - STATUS" % p.name)
+                        send_to(p, _STATUS_FMT % current.name)
 
-                # 道具階段
-                print(format_log("%s - TOOL" % current.name))
-                ConnectionManager.send_to(current, "TOOL\n")
+                # 發送最新手牌，並進入道具階段
+                out_current = self._hand_update(current)
+                log("%s - TOOL" % current.name)
+                out_current.append(_TOOL)
+                send_many(current, out_current)
 
                 msg = self._get_cmd(current)
                 if msg is None:
                     continue
 
                 extra_guess = False
+                # 送給 current 的訊息先累積，遇到需要等待回覆時再一次送出
+                out_current = []
                 if msg["type"] == "COMMAND" and msg["data"].isdigit():
                     ci = int(msg["data"]) - 1
                     if 0 <= ci < len(current.tool_hand):
                         tool = current.tool_hand.pop(ci)
-                        print(format_log(u"%s - 使用 %s" % (current.name, tool)))
+                        log(u"%s - 使用 %s" % (current.name, tool))
                         game.discard_tool.append(tool)
 
-                        print(format_log("%s - USED_TOOL" % current.name))
-                        ConnectionManager.send_to(current, "USED_TOOL %s\n" % tool)
-                        print(format_log("BROADCAST(skip %s) - OPP_TOOL" % current.name))
-                        self.broadcast("OPP_TOOL %s %s\n" % (current.name, tool), skip=current)
-
-                        if tool == "POS":
-                            # POS 道具處理
-                            print(format_log("BROADCAST(skip %s) - POS" % current.name))
-                            self.broadcast("POS %s %s\n" % (current.name, tool), skip=current)
-
-                            pos_msg = self._get_cmd(current)
-                            if pos_msg is None:
-                                continue
+                        log("%s - USED_TOOL" % current.name)
+                        out_current.append(_USED_TOOL_FMT % tool)
+                        log("BROADCAST(skip %s) - OPP_TOOL" % current.name)
+                        self.broadcast(_OPP_TOOL_FMT % (current.name, tool), skip=current)
 
-                            pos = int(pos_msg["data"])
+                        handler = self._TOOL_HANDLERS.get(tool)
+                        if handler is not None:
                             if len(self.players) < 2:
-                                ConnectionManager.send_to(current, "WINNER\n")
+                                send_to(current, _WINNER)
+                                self._conn_mgr.unregister_session(self)
                                 return
-
-                            opponent = self.players[(idx + 1) % 2]
-                            digit = ToolCard.pos(opponent.answer, pos)
-                            print(format_log("%s - POS_RESULT" % current.name))
-                            ConnectionManager.send_to(current, "POS_RESULT %d %s\n" % (pos, digit))
-
-                        elif tool == "SHUFFLE":
-                            ToolCard.shuffle(current.answer)
-                            print(format_log("%s - SHUFFLE_RESULT" % current.name))
-                            ConnectionManager.send_to(current, "SHUFFLE_RESULT %s\n" % "".join(current.answer))
-
-                        elif tool == "EXCLUDE":
-                            if len(self.players) < 2:
-                                ConnectionManager.send_to(current, "WINNER\n")
-                                return
-                            opponent = self.players[(idx + 1) % 2]
-                            exclude_result = ToolCard.exclude(opponent.answer)
-                            print(format_log("%s - EXCLUDE_RESULT" % current.name))
-                            ConnectionManager.send_to(current, "EXCLUDE_RESULT %s\n" % exclude_result)
-
-                        elif tool == "DOUBLE":
-                            extra_guess = True
-                            print(format_log("%s - DOUBLE_ACTIVE" % current.name))
-                            ConnectionManager.send_to(current, "DOUBLE_ACTIVE\n")
-
-                        elif tool == "RESHUFFLE":
-                            ToolCard.reshuffle(current.number_hand, game.number_deck)
-                            print(format_log("%s - RESHUFFLE_DONE" % current.name))
-                            ConnectionManager.send_to(current, "RESHUFFLE_DONE\n")
+                            extra_guess = handler(self, game, current, idx, out_current)
+                            if extra_guess is None:
+                                continue
 
                 # 猜測階段
                 guesses = 2 if extra_guess else 1
                 for _ in range(guesses):
                     nums = ",".join(current.number_hand)
-                    tools = ",".join(current.tool_hand)
-                    print(format_log("%s - HAND" % current.name))
-                    ConnectionManager.send_to(current, "HAND %s;%s\n" % (nums, tools))
-                    print(format_log("%s - GUESS" % current.name))
-                    ConnectionManager.send_to(current, "GUESS %s\n" % nums)
-
-                    guess_msg = self._get_cmd(current)
-                    if guess_msg is None:
+                    out_current.extend(self._hand_update(current, nums))
+                    log("%s - GUESS" % current.name)
+                    guess_prompt = _GUESS_FMT % nums
+                    out_current.append(guess_prompt)
+                    send_many(current, out_current)
+                    out_current = []
+
+                    guess = self._read_guess(current, num_digits, guess_prompt)
+                    if guess is None:
                         continue
 
-                    guess = str(guess_msg["data"])
-                    print(format_log(u"%s - 猜了 %s" % (current.name, guess)))
-                    for d in guess:
-                        current.number_hand.remove(d)
-                        game.discard_number.append(d)
+                    log(u"%s - 猜了 %s" % (current.name, guess))
+                    # 一次掃過手牌，移除猜測用掉的數字牌
+                    need = Counter(guess)
+                    new_hand = []
+                    for c in current.number_hand:
+                        if need[c] > 0:
+                            need[c] -= 1
+                            game.discard_number.append(c)
+                        else:
+                            new_hand.append(c)
+                    current.number_hand = new_hand
                     game.draw_up(current)
                     a, b = game.check_guess(opponent.answer, list(guess))
-                    print(format_log("%s - RESULT" % current.name))
-                    ConnectionManager.send_to(current, "RESULT %d %d\n" % (a, b))
-                    print(format_log("%s - OPP_GUESS" % opponent.name))
-                    ConnectionManager.send_to(opponent, "OPP_GUESS %s %s %d %d\n" % (current.name, guess, a, b))
+                    log("%s - RESULT" % current.name)
+                    out_current.append(_RESULT_FMT % (a, b))
+                    log("%s - OPP_GUESS" % opponent.name)
+                    send_to(opponent, _OPP_GUESS_FMT % (current.name, guess, a, b))
 
-                    if a == game.NUM_GUESS_DIGITS:
+                    if a == num_digits:
+                        send_many(current, out_current)
                         # 猜中，全部玩家廣播勝利
-                        self.broadcast("WINNER %s\n" % current.name)
-                        print(format_log("%s - WINNER" % "BROADCAST"))
+                        self.broadcast(_WINNER_FMT % current.name)
+                        log("%s - WINNER" % "BROADCAST")
                         self._close_game()
                         return
 
+                send_many(current, out_current)
+
             self._end_turn(game.to_dict())
             game.round += 1
 
         # 所有回合跑完，沒人猜中 → 平局
         for p in self.players:
-            ConnectionManager.send_to(p, "DRAW\n")
+            send_to(p, _DRAW)
         self._close_game()
 
 
 def match_maker(conn_mgr):
-    """不斷配對兩人一組，並開 Thread 執行"""
+    """不斷配對兩人一組，並開 Thread 執行；等待中已斷線的玩家直接略過"""
+    p1 = None
     while True:
-        p1 = conn_mgr._waiting_queue.get()
-        p2 = conn_mgr._waiting_queue.get()
-        session = GameSession(p1, p2)
-        conn_mgr.active_sessions[str(session._id)] = session
-        print(format_log("配對到 %s 和 %s，啟動新遊戲房間" % (p1.name, p2.name)))
+        player = conn_mgr._waiting_queue.get()
+        if not player.is_alive:
+            log("%s 已斷線，移出等待佇列" % player.name)
+            continue
+        if p1 is None or not p1.is_alive:
+            p1 = player
+            continue
+        if player.name == p1.name:
+            # 同一 id 的新連線取代等待中的舊連線：可能是舊連線已斷但心跳
+            # 還沒偵測到，也可能是同一目錄下共用 player_id.txt 的用戶端
+            log("%s 以相同 id 重新連線，取代等待中的舊連線" % player.name)
+            ConnectionManager.send_to(p1, _DUPLICATE_ID)
+            p1.socket.close()
+            p1 = player
+            continue
+        p2 = player
+        session = GameSession(p1, p2, conn_mgr)
+        conn_mgr.register_session(session)
+        log("配對到 %s 和 %s，啟動新遊戲房間" % (p1.name, p2.name))
         t = threading.Thread(target=session.run)
         t.daemon = True
         t.start()
+        p1 = None
 
 
 if __name__ == "__main__":